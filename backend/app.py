@@ -1,17 +1,57 @@
+import atexit
+import functools
+import hashlib
+import multiprocessing
 import os
-from datetime import datetime
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from io import BytesIO
 from typing import IO
 
 import google.generativeai as genai
-import PyPDF2
+import orjson
+import pypdfium2 as pdfium
+import zstandard as zstd
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, jsonify, request
+from flask.json.provider import DefaultJSONProvider, JSONProvider
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from pgvector.sqlalchemy import HALFVEC
+from sqlalchemy import delete, func, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer
+
+import pdf_extract
 
 # --- CONFIGURATION & INITIALIZATION ---
 load_dotenv()
+
+class OrjsonProvider(JSONProvider):
+    """Serializes responses with orjson, which is much faster than the stdlib on large summaries."""
+    option = orjson.OPT_NAIVE_UTC
+    # Types orjson can't encode natively (Decimal, etc.) fall back to Flask's usual conversions.
+    default = staticmethod(DefaultJSONProvider.default)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.option),
+                                        mimetype="application/json")
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # --- DATABASE CONFIGURATION FOR RENDER (PostgreSQL) ---
 db_url = os.getenv("DATABASE_URL")
@@ -22,11 +62,21 @@ if db_url.startswith("postgres://"):
 
 app.config.from_mapping(
     SQLALCHEMY_DATABASE_URI=db_url,
-    SQLALCHEMY_TRACK_MODIFICATIONS=False
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    # LIFO keeps a small set of warm connections in use; recycling avoids Render's idle-connection kills.
+    SQLALCHEMY_ENGINE_OPTIONS={
+        "pool_size": 20,
+        "max_overflow": 30,
+        "pool_timeout": 10,
+        "pool_recycle": 3600,
+        "pool_pre_ping": True,
+        "pool_use_lifo": True,
+    }
 )
 # --- END DATABASE CONFIGURATION ---
 
-CORS(app, origins=["https://legalmind-ai-86ev.onrender.com", "http://localhost:8000", "http://127.0.0.1:5500"])
+CORS(app, origins=["https://legalmind-ai-86ev.onrender.com", "http://localhost:8000", "http://127.0.0.1:5500"],
+     expose_headers=["X-Next-Cursor"]) # The frontend reads list pagination cursors from this header
 db = SQLAlchemy(app)
 
 
@@ -38,18 +88,34 @@ class Document(db.Model):
     upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     status = db.Column(db.String(50), nullable=False, default='Pending')
     summary = db.Column(db.Text, nullable=True)
-    full_text = db.Column(db.Text, nullable=True)
+    # zstd-compressed UTF-8; read it through .text. Deferred: only loaded when asked for.
+    full_text = db.Column(db.LargeBinary, nullable=True, deferred=True)
+    text_hash = db.Column(db.CHAR(64), nullable=True, index=True)
+    # sha256 of the uploaded PDF bytes, so a re-upload can skip text extraction.
+    pdf_hash = db.Column(db.CHAR(64), nullable=True, index=True)
+    # EXTRACTION_VERSION that produced full_text; only text from the current extractor is reused.
+    extraction_version = db.Column(db.SmallInteger, nullable=True)
     model_used = db.Column(db.String(100), nullable=True)
+    # Gemini CachedContent holding full_text, so /ask can send just the question.
+    cached_content_name = db.Column(db.String(200), nullable=True)
+    cached_content_model = db.Column(db.String(100), nullable=True)
+    cached_content_expires_at = db.Column(db.DateTime, nullable=True)
 
-    def to_dict(self):
+    __table_args__ = (db.Index('ix_document_upload_date_id_desc', upload_date.desc(), id.desc()),)
+
+    @property
+    def text(self):
+        return _decompress_text(self.full_text)
+
+    def to_full_dict(self):
         return {
             "id": self.id,
             "filename": self.filename,
             "upload_date": self.upload_date.strftime('%b %d, %Y'),
             "status": self.status,
+            "model_used": self.model_used,
             "summary": self.summary,
-            "full_text": self.full_text,
-            "model_used": self.model_used
+            "full_text": self.text
         }
 
 class HistoryEvent(db.Model):
@@ -58,28 +124,106 @@ class HistoryEvent(db.Model):
     document_name = db.Column(db.String(300), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "event_type": self.event_type,
-            "document_name": self.document_name,
-            "timestamp": self.timestamp.strftime('%b %d, %Y, %I:%M %p')
-        }
+    __table_args__ = (db.Index('ix_history_timestamp_id_desc', timestamp.desc(), id.desc()),)
+
+class LLMCache(db.Model):
+    __tablename__ = 'llm_cache'
+    key = db.Column(db.CHAR(64), primary_key=True)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+EMBEDDING_DIM = 768
+
+class QACache(db.Model):
+    __tablename__ = 'qa_cache'
+    id = db.Column(db.Integer, primary_key=True)
+    # Answers are only reused for the same document and model, never across documents.
+    document_hash = db.Column(db.CHAR(64), nullable=False)
+    model_name = db.Column(db.String(100), nullable=False)
+    # 'qa' for /ask questions, 'analysis' for /simplify user prompts.
+    kind = db.Column(db.String(20), nullable=False, default='qa')
+    question = db.Column(db.Text, nullable=False)
+    # Stored as FP16 (halfvec): half the bytes of a float32 vector for the same nearest-neighbour results.
+    question_embedding = db.Column(HALFVEC(EMBEDDING_DIM), nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Lookups are always scoped to one document's few rows, so the distance search is exact over those
+    # rows. An ANN index would search globally and apply these filters afterwards, dropping matches.
+    __table_args__ = (db.Index('ix_qa_cache_document_model_kind', document_hash, model_name, kind),)
 
 # --- DATABASE SETUP COMMAND ---
+# create_all() never alters a table that already exists, so columns added to a model since the
+# table was created are brought in here. Every statement is safe to re-run.
+_SCHEMA_UPGRADES = [
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS text_hash CHAR(64)",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS pdf_hash CHAR(64)",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS extraction_version SMALLINT",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS cached_content_name VARCHAR(200)",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS cached_content_model VARCHAR(100)",
+    "ALTER TABLE document ADD COLUMN IF NOT EXISTS cached_content_expires_at TIMESTAMP WITHOUT TIME ZONE",
+    # full_text used to be plain text; existing rows become their UTF-8 bytes, which .text still reads.
+    """
+    DO $$ BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'document' AND column_name = 'full_text') = 'text' THEN
+            ALTER TABLE document ALTER COLUMN full_text TYPE BYTEA USING convert_to(full_text, 'UTF8');
+        END IF;
+    END $$
+    """,
+    # Superseded by the (timestamp, id) keyset indexes.
+    "DROP INDEX IF EXISTS ix_document_upload_date_desc",
+    "DROP INDEX IF EXISTS ix_history_timestamp_desc",
+    "ALTER TABLE qa_cache ADD COLUMN IF NOT EXISTS kind VARCHAR(20) NOT NULL DEFAULT 'qa'",
+    "DROP INDEX IF EXISTS ix_qa_cache_question_embedding_hnsw",
+    "DROP INDEX IF EXISTS ix_qa_cache_document_hash", # Covered by the leading column of ix_qa_cache_document_model_kind
+    f"""
+    DO $$ BEGIN
+        IF (SELECT udt_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'qa_cache' AND column_name = 'question_embedding') = 'vector' THEN
+            ALTER TABLE qa_cache ALTER COLUMN question_embedding TYPE HALFVEC({EMBEDDING_DIM});
+        END IF;
+    END $$
+    """,
+]
+
+def init_db():
+    """Creates the database tables, or upgrades existing ones to the current models."""
+    with app.app_context():
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        db.session.commit()
+        db.create_all()
+        for statement in _SCHEMA_UPGRADES:
+            db.session.execute(text(statement))
+        db.session.commit()
+        # Likewise, add any indexes declared since the tables were created.
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        purge_expired_cache()
+
 @app.cli.command("init-db")
 def init_db_command():
     """Creates the database tables."""
-    with app.app_context(): # Ensure app context for CLI command
-        db.create_all()
+    init_db()
     print("Database tables initialized successfully.")
 
 # --- GEMINI API SETUP ---
+ALLOWED_MODELS = ['gemini-1.5-pro', 'gemini-1.5-flash']
+
+# GenerativeModel instances are reused across requests; building one per request is wasted work.
+@functools.lru_cache(maxsize=4)
+def _model(name: str):
+    return genai.GenerativeModel(name)
+
 try:
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("GOOGLE_API_KEY not found in .env file or environment.")
     genai.configure(api_key=api_key)
+    for name in ALLOWED_MODELS: # Pre-warm so the first request doesn't pay construction cost
+        _model(name)
 except Exception as e:
     print(f"FATAL: Error configuring Gemini API - {e}")
     raise
@@ -87,37 +231,522 @@ except Exception as e:
 # --- HELPER FUNCTIONS ---
 def get_gemini_model(model_name: str):
     try:
-        allowed_models = ['gemini-1.5-pro', 'gemini-1.5-flash']
-        if model_name not in allowed_models:
+        if model_name not in ALLOWED_MODELS:
             model_name = 'gemini-1.5-flash'
-        return genai.GenerativeModel(model_name)
+        return _model(model_name)
     except Exception as e:
         raise ValueError(f"Failed to initialize Gemini model '{model_name}': {e}")
 
-def extract_text_from_pdf(file_stream: IO):
+# PDFs shorter than this are extracted inline; forking workers costs more than it saves. Longer ones
+# are also extracted inline when no worker pool can be used.
+PARALLEL_EXTRACT_MIN_PAGES = 4
+# Processes, not threads: PDFium is not thread-safe, and pypdfium2 does no locking of its own.
+EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+# A PDF that hangs PDFium fails the upload after this long instead of holding the request forever.
+EXTRACT_TIMEOUT_SECONDS = int(os.getenv("EXTRACT_TIMEOUT_SECONDS", "120"))
+_extract_executor = None
+_extract_executor_lock = threading.Lock()
+
+def _extract_start_method():
+    # forkserver where the platform has it: forking a process that holds a live gRPC channel (the Gemini
+    # client) isn't safe. Windows only has spawn.
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _get_extract_executor():
+    """Returns the shared extraction pool, or None when pages should be extracted in this process."""
+    global _extract_executor
+    if __name__ == "__main__":
+        # Started with `python app.py`: every worker would re-run this script as __mp_main__ and rebuild
+        # the whole app (engine, Gemini client, executors), so the dev server extracts inline.
+        return None
+    with _extract_executor_lock:
+        if _extract_executor is None:
+            try:
+                ctx = multiprocessing.get_context(_extract_start_method())
+                if ctx.get_start_method() == "forkserver":
+                    # Workers run pdf_extract's functions, and the fork server preloads only that module.
+                    ctx.set_forkserver_preload(["pdf_extract"])
+                _extract_executor = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=ctx)
+            except Exception as e:
+                print(f"PDF extraction pool unavailable, extracting in-process: {e}")
+                return None
+    return _extract_executor
+
+def _discard_extract_executor(executor):
+    # A pool whose worker died (a PDFium crash, an OOM kill) or hung is unusable; the next caller builds a new one.
+    global _extract_executor
+    with _extract_executor_lock:
+        if _extract_executor is executor:
+            _extract_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _extract_in_pool(executor, pdf_bytes: bytes, n_pages: int):
+    # One contiguous range per worker, so the PDF is sent and reopened once per worker, not once per page.
+    futures = [executor.submit(pdf_extract.extract_pages, pdf_bytes, start, stop) for start, stop in _page_ranges(n_pages, EXTRACT_WORKERS)]
+    deadline = time.monotonic() + EXTRACT_TIMEOUT_SECONDS
     try:
-        reader = PyPDF2.PdfReader(file_stream)
-        text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
-        return text
+        return [text for future in futures for text in future.result(timeout=max(0, deadline - time.monotonic()))]
+    except FutureTimeoutError:
+        _discard_extract_executor(executor)
+        raise TimeoutError(f"PDF text extraction took longer than {EXTRACT_TIMEOUT_SECONDS}s")
+
+def _page_ranges(n_pages: int, n_parts: int):
+    """Splits range(n_pages) into at most n_parts contiguous (start, stop) ranges of near-equal size."""
+    n_parts = min(n_parts, n_pages)
+    size, extra = divmod(n_pages, n_parts)
+    start = 0
+    for i in range(n_parts):
+        stop = start + size + (1 if i < extra else 0)
+        yield start, stop
+        start = stop
+
+# Requests are handled on concurrent threads, so every PDFium call made in this process goes through this lock.
+_pdfium_lock = threading.Lock()
+
+def iter_pdf_pages(file_stream: IO):
+    """Yields the text of each page in order."""
+    pdf_bytes = file_stream.read()
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            n_pages = len(pdf)
+            executor = _get_extract_executor() if n_pages >= PARALLEL_EXTRACT_MIN_PAGES else None
+            inline_pages = [pdf_extract.page_text(page) for page in pdf] if executor is None else None
+        finally:
+            pdf.close()
+    if inline_pages is not None:
+        yield from inline_pages
+        return
+    try:
+        yield from _extract_in_pool(executor, pdf_bytes, n_pages)
+    except BrokenProcessPool:
+        # Retry once on a fresh pool: the dead worker may have been an unrelated upload's. If this PDF
+        # breaks the pool again, it fails; it is never retried in-process, where a crash takes down the server.
+        _discard_extract_executor(executor)
+        executor = _get_extract_executor()
+        if executor is None:
+            raise
+        try:
+            yield from _extract_in_pool(executor, pdf_bytes, n_pages)
+        except BrokenProcessPool:
+            _discard_extract_executor(executor)
+            raise
+
+# Compiled once: extracted text is full of padding runs that Gemini would otherwise bill as tokens.
+_SPACE_RUN_RE = re.compile(r'[ \t\f\v]+')
+_TRAILING_SPACE_RE = re.compile(r' (?=\r?\n)')
+
+def _collapse_whitespace(text: str):
+    return _TRAILING_SPACE_RE.sub('', _SPACE_RUN_RE.sub(' ', text))
+
+PAGE_SEPARATOR = "\n"
+# Bump whenever a change here alters the extracted text, so re-uploads stop reusing the old output.
+EXTRACTION_VERSION = 1
+
+def extract_text_from_pdf(file_stream: IO, hasher=None):
+    try:
+        parts = []
+        for page_text in iter_pdf_pages(file_stream):
+            page_text = _collapse_whitespace(page_text)
+            if hasher is not None:
+                if parts:
+                    hasher.update(PAGE_SEPARATOR.encode("utf-8"))
+                hasher.update(page_text.encode("utf-8"))
+            parts.append(page_text)
+        return PAGE_SEPARATOR.join(parts)
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return None
 
-def log_event(event_type: str, document_name: str):
-    with app.app_context(): # Ensure app context for db operations outside request context
-        event = HistoryEvent(event_type=event_type, document_name=document_name)
-        db.session.add(event)
+# Level 9 compresses legal text noticeably better than the default (3) and is still a few ms per document.
+ZSTD_LEVEL = 9
+
+def find_extracted_text(pdf_hash: str):
+    """Returns (text, text_hash) already extracted from an identical PDF, or (None, None)."""
+    row = db.session.execute(
+        select(Document.full_text, Document.text_hash)
+        .where(Document.pdf_hash == pdf_hash, Document.extraction_version == EXTRACTION_VERSION,
+               Document.full_text.is_not(None))
+        .limit(1)
+    ).first()
+    if row is None:
+        return None, None
+    document_text = _decompress_text(row.full_text)
+    return document_text, row.text_hash or _document_hash(document_text)
+
+def _compress_text(value: str):
+    return zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(value.encode("utf-8"))
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def _decompress_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    # Rows stored before compression was introduced hold the text's plain UTF-8 bytes.
+    if not value.startswith(_ZSTD_MAGIC):
+        return value.decode("utf-8")
+    return zstd.ZstdDecompressor().decompress(value).decode("utf-8")
+
+# Generation is pinned to temperature 0 so identical prompts give identical answers and can be cached.
+GENERATION_CONFIG = {"temperature": 0}
+LLM_CACHE_TTL = timedelta(days=7)
+# Expired responses are deleted at most this often per process, by whichever cache_put comes due.
+LLM_CACHE_PURGE_INTERVAL = timedelta(hours=1)
+_last_cache_purge = None
+
+def _llm_cache_key(model_name: str, prompt: str):
+    return hashlib.sha256(f"{model_name}\x00{prompt}".encode("utf-8")).hexdigest()
+
+# The caches are best-effort: a cache that can't be read or written never fails the request it serves.
+def cache_get(key: str):
+    try:
+        return db.session.execute(
+            select(LLMCache.response).where(LLMCache.key == key, LLMCache.expires_at > datetime.utcnow())
+        ).scalar()
+    except Exception as e:
+        print(f"Response cache lookup failed, calling the model: {e}")
+        db.session.rollback()
+        return None
+
+def purge_expired_cache():
+    db.session.execute(delete(LLMCache).where(LLMCache.expires_at <= datetime.utcnow()))
+    db.session.commit()
+
+def cache_put(key: str, response: str):
+    global _last_cache_purge
+    now = datetime.utcnow()
+    try:
+        db.session.merge(LLMCache(key=key, response=response, created_at=now, expires_at=now + LLM_CACHE_TTL))
         db.session.commit()
+    except IntegrityError:
+        # A concurrent request cached the same prompt first; its answer is just as good.
+        db.session.rollback()
+    except Exception as e:
+        print(f"Could not cache the model response: {e}")
+        db.session.rollback()
 
-def _build_analysis_prompt(document_text: str, user_prompt: str):
-    return f"""
+    if _last_cache_purge is None or now - _last_cache_purge >= LLM_CACHE_PURGE_INTERVAL:
+        _last_cache_purge = now
+        try:
+            purge_expired_cache()
+        except Exception as e:
+            print(f"Could not purge expired cached responses: {e}")
+            db.session.rollback()
+
+# Caps in-flight Gemini requests per process so bursts queue here instead of at the API's rate limiter.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "10"))
+_gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+_inflight_calls = {}
+_inflight_lock = threading.Lock()
+
+def _approx_tokens(text: str):
+    return len(text) // 4
+
+class TokenBucket:
+    """Thread-safe client-side pacing for Gemini's requests-per-minute and tokens-per-minute quotas."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, estimated_tokens: int = 0):
+        """Blocks until one request and estimated_tokens fit in the current minute's budget."""
+        estimated_tokens = min(estimated_tokens, self.tpm) # An oversized prompt waits for a full bucket, not forever
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= estimated_tokens:
+                    self._requests -= 1
+                    self._tokens -= estimated_tokens
+                    return
+                wait = max((1 - self._requests) * 60 / self.rpm, (estimated_tokens - self._tokens) * 60 / self.tpm)
+            time.sleep(wait)
+
+# Sized to the project's Gemini tier; the bucket is per process, so divide by the worker count.
+gemini_rate_limiter = TokenBucket(rpm=int(os.getenv("GEMINI_RPM", "1000")), tpm=int(os.getenv("GEMINI_TPM", "4000000")))
+
+def call_gemini(model_instance, prompt: str, key: str):
+    """Calls Gemini, sharing one request between concurrent callers that send an identical prompt."""
+    with _inflight_lock:
+        future = _inflight_calls.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight_calls[key] = future
+    if not is_leader:
+        return future.result()
+
+    try:
+        gemini_rate_limiter.acquire(_approx_tokens(prompt))
+        with _gemini_slots:
+            answer = model_instance.generate_content(prompt, generation_config=GENERATION_CONFIG).text
+        future.set_result(answer)
+        return answer
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_calls.pop(key, None)
+
+EMBEDDING_MODEL = 'models/text-embedding-004'
+# Cosine distance below which an earlier question or analysis request counts as the same one.
+# Analyses are long and costly to get wrong, so they need a closer match (similarity >= 0.92).
+SEMANTIC_CACHE_MAX_DISTANCE = {'qa': 0.15, 'analysis': 0.08}
+
+def _document_hash(document_text: str):
+    return hashlib.sha256(document_text.encode("utf-8")).hexdigest()
+
+def embed_question(question: str):
+    result = genai.embed_content(model=EMBEDDING_MODEL, content=question, task_type="semantic_similarity")
+    return result['embedding']
+
+def try_embed_question(question: str):
+    try:
+        return embed_question(question)
+    except Exception as e:
+        print(f"Question embedding failed, skipping semantic cache: {e}")
+        return None
+
+def qa_cache_lookup(document_hash: str, model_name: str, embedding, kind: str = 'qa'):
+    distance = QACache.question_embedding.cosine_distance(embedding)
+    try:
+        row = db.session.execute(
+            select(QACache.answer, distance.label('distance'))
+            .where(QACache.document_hash == document_hash, QACache.model_name == model_name, QACache.kind == kind)
+            .order_by(distance)
+            .limit(1)
+        ).first()
+    except Exception as e:
+        print(f"Semantic cache lookup failed, calling the model: {e}")
+        db.session.rollback()
+        return None
+    if row is not None and row.distance < SEMANTIC_CACHE_MAX_DISTANCE[kind]:
+        return row.answer
+    return None
+
+def qa_cache_put(document_hash: str, model_name: str, question: str, embedding, answer: str, kind: str = 'qa'):
+    try:
+        db.session.add(QACache(document_hash=document_hash, model_name=model_name, kind=kind, question=question,
+                               question_embedding=embedding, answer=answer))
+        db.session.commit()
+    except Exception as e:
+        print(f"Could not store the answer in the semantic cache: {e}")
+        db.session.rollback()
+
+def _cache_lookup(model_name: str, prompt: str, document_hash: str, user_prompt: str):
+    """Checks both cache tiers. Returns (key, cached answer or None, embedding for _cache_store or None)."""
+    key = _llm_cache_key(model_name, prompt)
+    cached = cache_get(key)
+    if cached is not None:
+        return key, cached, None
+
+    embedding = None
+    if document_hash and user_prompt:
+        embedding = try_embed_question(user_prompt)
+        if embedding is not None:
+            cached = qa_cache_lookup(document_hash, model_name, embedding, kind='analysis')
+    return key, cached, embedding
+
+def _cache_store(model_name: str, key: str, answer: str, document_hash: str, user_prompt: str, embedding):
+    cache_put(key, answer)
+    if embedding is not None:
+        qa_cache_put(document_hash, model_name, user_prompt, embedding, answer, kind='analysis')
+
+def generate_cached(model_instance, prompt: str, document_hash: str = None, user_prompt: str = None):
+    """Returns the model's answer for the prompt, reusing a stored response when one hasn't expired.
+
+    With document_hash and user_prompt, an analysis of the same document requested with a
+    paraphrased prompt is also reused (semantic tier).
+    """
+    model_name = model_instance.model_name
+    key, cached, embedding = _cache_lookup(model_name, prompt, document_hash, user_prompt)
+    if cached is not None:
+        return cached
+
+    db.session.commit() # End the read transaction so no pooled connection is held during the model call
+    answer = call_gemini(model_instance, prompt, key)
+    _cache_store(model_name, key, answer, document_hash, user_prompt, embedding)
+    return answer
+
+def stream_cached(model_instance, prompt: str, out: queue.SimpleQueue, document_hash: str = None, user_prompt: str = None):
+    """Like generate_cached, but also puts the answer on out piece by piece as Gemini generates it.
+
+    Meant to run on a worker thread: the slot is held only while Gemini generates, and the answer
+    is cached however slowly (or whether) a client reads out.
+    """
+    model_name = model_instance.model_name
+    key, cached, embedding = _cache_lookup(model_name, prompt, document_hash, user_prompt)
+    if cached is not None:
+        out.put(cached)
+        return cached
+
+    db.session.commit() # End the read transaction so no pooled connection is held during the model call
+    gemini_rate_limiter.acquire(_approx_tokens(prompt))
+    parts = []
+    with _gemini_slots:
+        for chunk in model_instance.generate_content(prompt, generation_config=GENERATION_CONFIG, stream=True):
+            parts.append(chunk.text)
+            out.put(chunk.text)
+    answer = "".join(parts)
+    _cache_store(model_name, key, answer, document_hash, user_prompt, embedding)
+    return answer
+
+def _event_row(event_type: str, document_name: str, timestamp: datetime):
+    return {"event_type": event_type, "document_name": document_name, "timestamp": timestamp}
+
+# History events are fire-and-forget audit rows, so they're written off the request path:
+# log_event() only enqueues, and a daemon thread bulk-inserts whatever has accumulated.
+EVENT_BATCH_SIZE = 100
+_event_q = queue.SimpleQueue()
+_event_writer = None
+_event_writer_lock = threading.Lock()
+
+def _take_queued_events(batch: list):
+    while len(batch) < EVENT_BATCH_SIZE:
+        try:
+            batch.append(_event_q.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _write_events(batch: list):
+    with app.app_context():
+        try:
+            db.session.bulk_insert_mappings(HistoryEvent, batch)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Failed to write {len(batch)} history events: {e}")
+
+def _write_events_forever():
+    while True:
+        _write_events(_take_queued_events([_event_q.get()]))
+
+@atexit.register
+def _flush_events():
+    # The writer is a daemon thread, so events still queued at shutdown or redeploy are written here.
+    while True:
+        batch = _take_queued_events([])
+        if not batch:
+            return
+        _write_events(batch)
+
+def _ensure_event_writer():
+    # Started lazily so each (possibly forked) worker process gets its own writer thread.
+    global _event_writer
+    if _event_writer is not None and _event_writer.is_alive():
+        return
+    with _event_writer_lock:
+        if _event_writer is None or not _event_writer.is_alive():
+            _event_writer = threading.Thread(target=_write_events_forever, name="history-events", daemon=True)
+            _event_writer.start()
+
+def log_event(event_type: str, document_name: str):
+    _ensure_event_writer()
+    _event_q.put(_event_row(event_type, document_name, datetime.utcnow()))
+
+def _record_analysis_result(doc_id, filename: str, status: str, summary: str, event_type: str):
+    db.session.execute(update(Document).where(Document.id == doc_id).values(summary=summary, status=status))
+    log_event(event_type, filename)
+    db.session.commit()
+
+# Gemini only caches content for pinned model versions, and only above a minimum size
+# (32,768 input tokens for the gemini-1.5-*-002 models mapped here).
+CONTEXT_CACHE_MODELS = {
+    'models/gemini-1.5-pro': 'models/gemini-1.5-pro-002',
+    'models/gemini-1.5-flash': 'models/gemini-1.5-flash-002',
+}
+CONTEXT_CACHE_MIN_TOKENS = 32_768
+CONTEXT_CACHE_TTL = timedelta(hours=1)
+_QA_SYSTEM_INSTRUCTION = "You are an AI assistant answering questions about the following legal document."
+
+def find_context_cache(document_hash: str, model_name: str):
+    try:
+        return db.session.execute(
+            select(Document.cached_content_name).where(
+                Document.text_hash == document_hash,
+                Document.cached_content_model == model_name,
+                Document.cached_content_expires_at > datetime.utcnow(),
+            ).order_by(Document.cached_content_expires_at.desc()).limit(1)
+        ).scalar()
+    except Exception as e:
+        print(f"Context cache lookup failed, sending the full document: {e}")
+        db.session.rollback()
+        return None
+
+def create_context_cache(doc_id, document_text: str, document_hash: str, model_name: str):
+    """Uploads the document once as Gemini cached content so follow-up questions don't resend it."""
+    cache_model = CONTEXT_CACHE_MODELS.get(model_name)
+    if cache_model is None or _approx_tokens(document_text) < CONTEXT_CACHE_MIN_TOKENS:
+        return
+    with app.app_context(): # Runs on a worker thread, outside any request
+        # Cache hits and re-uploads of the same text would otherwise each pay for another hour of cache.
+        if find_context_cache(document_hash, model_name):
+            return
+        try:
+            cache = genai.caching.CachedContent.create(
+                model=cache_model, system_instruction=_QA_SYSTEM_INSTRUCTION,
+                contents=[document_text], ttl=CONTEXT_CACHE_TTL,
+            )
+            db.session.execute(update(Document).where(Document.id == doc_id).values(
+                cached_content_name=cache.name, cached_content_model=model_name,
+                cached_content_expires_at=datetime.utcnow() + CONTEXT_CACHE_TTL,
+            ))
+            db.session.commit()
+        except Exception as e:
+            print(f"Could not create Gemini context cache for document {doc_id}: {e}")
+            db.session.rollback()
+
+@functools.lru_cache(maxsize=64)
+def _cached_content_model(cache_name: str):
+    return genai.GenerativeModel.from_cached_content(cached_content=cache_name)
+
+# Queued analyses run here so /simplify?async can return before Gemini answers.
+_analysis_executor = ThreadPoolExecutor(max_workers=int(os.getenv("ANALYSIS_WORKERS", "8")), thread_name_prefix="analysis")
+
+def analyze_document(doc_id, filename: str, document_text: str, document_hash: str, user_prompt: str, model_name: str):
+    with app.app_context(): # Runs on a worker thread, outside any request
+        try:
+            db.session.execute(update(Document).where(Document.id == doc_id).values(status='In Progress'))
+            db.session.commit()
+            model_instance = get_gemini_model(model_name)
+            full_prompt = build_analysis_prompt(model_instance, document_text, user_prompt)
+            summary = generate_cached(model_instance, full_prompt, document_hash, user_prompt)
+            _record_analysis_result(doc_id, filename, 'Analyzed', summary, "ANALYSIS_SUCCESS")
+        except Exception as e:
+            print(f"An error occurred during background analysis of document {doc_id}: {e}")
+            db.session.rollback()
+            _record_analysis_result(doc_id, filename, 'Analysis Failed', f"Analysis failed: {e}", "ANALYSIS_FAIL")
+            return
+    create_context_cache(doc_id, document_text, document_hash, model_instance.model_name)
+
+# Prompt templates are split around their variable fields once at import time, so building a
+# prompt is a single join instead of re-formatting the whole template on every request.
+# Static text first, then the document, then the user's request: Gemini's implicit prompt cache
+# matches on prefixes, so repeat analyses of one document with different requests share a prefix.
+_ANALYSIS_PROMPT_PREFIX = '''
 **Role:** You are an expert legal analyst AI specializing in **Indian Law**.
 **Task:** Analyze the provided legal document from the perspective of **Indian law**.
 ---
-**User's Specific Request:** "{user_prompt}"
----
 **Document Text:**
-{document_text}
+'''
+_ANALYSIS_PROMPT_MID = '''
+---
+**User's Specific Request:** "'''
+_ANALYSIS_PROMPT_SUFFIX = '''"
 ---
 ### **1.Summary**
 *(1.Provide a 1-4 sentence overview of the document's core purpose with key details and risks,
@@ -156,20 +785,70 @@ def _build_analysis_prompt(document_text: str, user_prompt: str):
 1.  **Immediate Action:** *(Suggest the most critical next step.)*
 2.  **Recommendation:** *(Suggest an important action.)*
 3.  **General Advice:** *(e.g., "Consult a lawyer practicing in India.")*
-"""
+'''
 
-def _build_qa_prompt(document_text: str, question: str):
-    return f"""
+def _build_analysis_prompt(document_text: str, user_prompt: str):
+    return "".join((_ANALYSIS_PROMPT_PREFIX, document_text, _ANALYSIS_PROMPT_MID, user_prompt, _ANALYSIS_PROMPT_SUFFIX))
+
+_QA_PROMPT_PREFIX = '''
 **Context:** You are an AI assistant answering questions about the following legal document.
 **Document Text:**
 ---
-{document_text}
+'''
+_QA_PROMPT_MID = '''
 ---
-**User's Question:** "{question}"
+**User's Question:** "'''
+_QA_PROMPT_SUFFIX = '''"
 **Your Answer:**
-"""
+'''
+
+# Documents estimated above this are condensed part by part before analysis (map-reduce), leaving
+# headroom under the 1M-token window of the smallest allowed model.
+MAX_PROMPT_TOKENS = 900_000
+CHUNK_TOKENS = 200_000
+
+_CHUNK_PROMPT_PREFIX = '''
+**Role:** You are an expert legal analyst AI specializing in **Indian Law**.
+**Task:** The text below is one part of a longer legal document. Write dense notes on this part only,
+keeping every clause number, party, amount, date, deadline, obligation, penalty and risk it mentions.
+---
+**Document Text:**
+'''
+
+def _build_chunk_prompt(chunk_text: str, part: int, total: int):
+    return "".join((_CHUNK_PROMPT_PREFIX, chunk_text, f"\n---\n**Notes on part {part} of {total}:**\n"))
+
+def condense_document(model_instance, document_text: str):
+    """Returns the text to analyze: the document itself, or per-part notes when it's too large to send whole."""
+    if _approx_tokens(document_text) <= MAX_PROMPT_TOKENS:
+        return document_text
+    chunk_chars = CHUNK_TOKENS * 4
+    chunks = [document_text[i:i + chunk_chars] for i in range(0, len(document_text), chunk_chars)]
+    notes = [
+        generate_cached(model_instance, _build_chunk_prompt(chunk, part, len(chunks)))
+        for part, chunk in enumerate(chunks, start=1)
+    ]
+    return "\n\n".join(f"[Notes on part {part} of {len(chunks)}]\n{note}" for part, note in enumerate(notes, start=1))
+
+def build_analysis_prompt(model_instance, document_text: str, user_prompt: str):
+    return _build_analysis_prompt(condense_document(model_instance, document_text), user_prompt)
+
+def _build_qa_prompt(document_text: str, question: str):
+    return "".join((_QA_PROMPT_PREFIX, document_text, _QA_PROMPT_MID, question, _QA_PROMPT_SUFFIX))
+
+# Used with a context-cached document, where the cache already carries the context and document text.
+_CACHED_QA_PROMPT_PREFIX = '''**User's Question:** "'''
+
+def _build_cached_qa_prompt(question: str):
+    return "".join((_CACHED_QA_PROMPT_PREFIX, question, _QA_PROMPT_SUFFIX))
 
 # --- API ROUTES ---
+def _form_flag(name: str):
+    return request.form.get(name, '').lower() in ('1', 'true', 'yes')
+
+def _sse(payload: dict):
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
 @app.route('/simplify', methods=['POST'])
 def simplify_document():
     if 'pdfFile' not in request.files:
@@ -179,53 +858,114 @@ def simplify_document():
         return jsonify({"error": "No selected file."}), 400
 
     selected_model_name = request.form.get('model', 'gemini-1.5-flash')
-    
-    with app.app_context():
-        log_event("UPLOAD_SUCCESS", pdf_file.filename)
-    
-    document_text = extract_text_from_pdf(pdf_file.stream)
+    filename = pdf_file.filename
+    # Rows are written once the analysis finishes, which can be minutes later; date them by the upload.
+    uploaded_at = datetime.utcnow()
+    log_event("UPLOAD_SUCCESS", filename)
+
+    # Read the upload into memory once: it is hashed, and the parser then works on the buffer.
+    pdf_bytes = pdf_file.stream.read()
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    document_text, text_hash = find_extracted_text(pdf_hash)
+    if document_text is None:
+        text_hasher = hashlib.sha256()
+        document_text = extract_text_from_pdf(BytesIO(pdf_bytes), hasher=text_hasher)
+        text_hash = text_hasher.hexdigest()
     
     if not document_text or not document_text.strip():
-        with app.app_context():
-            failed_doc = Document(filename=pdf_file.filename, status='Analysis Failed', summary='Could not extract text from PDF.', model_used=selected_model_name)
-            db.session.add(failed_doc)
-            db.session.commit()
-            log_event("TEXT_EXTRACT_FAIL", pdf_file.filename)
+        db.session.add(Document(filename=filename, upload_date=uploaded_at, status='Analysis Failed',
+                                summary='Could not extract text from PDF.', model_used=selected_model_name))
+        log_event("TEXT_EXTRACT_FAIL", filename)
+        db.session.commit()
         return jsonify({"error": "Could not extract text from the PDF."}), 400
         
+    run_async = _form_flag('async')
+    run_stream = _form_flag('stream')
+    prompt_from_user = request.form.get('prompt', "Provide a comprehensive analysis.")
+
+    def new_document(status: str, summary: str = None):
+        return Document(filename=filename, upload_date=uploaded_at, status=status, summary=summary,
+                        full_text=_compress_text(document_text), text_hash=text_hash, pdf_hash=pdf_hash,
+                        extraction_version=EXTRACTION_VERSION, model_used=selected_model_name)
+
+    def analyze_streamed(model_instance, out: queue.SimpleQueue):
+        # Runs on an analysis worker, so the document is analyzed and saved even if the client disconnects.
+        # out receives text pieces, then the saved document's id or the exception that ended the analysis.
+        with app.app_context():
+            try:
+                full_prompt = build_analysis_prompt(model_instance, document_text, prompt_from_user)
+                summary = stream_cached(model_instance, full_prompt, out, text_hash, prompt_from_user)
+                new_doc = new_document('Analyzed', summary)
+                db.session.add(new_doc)
+                log_event("ANALYSIS_SUCCESS", filename)
+                db.session.flush()
+                new_doc_id = new_doc.id
+                db.session.commit()
+            except Exception as e:
+                print(f"An error occurred while streaming the analysis: {e}")
+                db.session.rollback()
+                db.session.add(new_document('Analysis Failed', f"Analysis failed: {e}"))
+                log_event("ANALYSIS_FAIL", filename)
+                db.session.commit()
+                out.put(e)
+                return
+        out.put(new_doc_id)
+        create_context_cache(new_doc_id, document_text, text_hash, model_instance.model_name)
+
+    def relay_analysis(out: queue.SimpleQueue):
+        """Relays the analysis to the client as server-sent events while Gemini generates it."""
+        yield _sse({"type": "document", "document_text": document_text})
+        while True:
+            item = out.get()
+            if isinstance(item, str):
+                yield _sse({"type": "delta", "text": item})
+            elif isinstance(item, Exception):
+                yield _sse({"type": "error", "error": "Failed to get a response from the AI model."})
+                return
+            else:
+                yield _sse({"type": "done", "doc_id": item})
+                return
+
     new_doc_id = None
     try:
-        with app.app_context():
-            new_doc = Document(filename=pdf_file.filename, status='In Progress', full_text=document_text, model_used=selected_model_name)
+        if run_async:
+            # The row has to exist before the worker starts, so queued uploads take one extra commit.
+            new_doc = new_document('Queued')
             db.session.add(new_doc)
+            db.session.flush()
+            new_doc_id = new_doc.id
             db.session.commit()
-            new_doc_id = new_doc.id # Save the ID for potential error handling
-
-        prompt_from_user = request.form.get('prompt', "Provide a comprehensive analysis.")
-        full_prompt = _build_analysis_prompt(document_text, prompt_from_user)
+            _analysis_executor.submit(analyze_document, new_doc_id, filename, document_text, text_hash,
+                                     prompt_from_user, selected_model_name)
+            return jsonify({"doc_id": new_doc_id, "status": "Queued", "document_text": document_text}), 202
         
         model_instance = get_gemini_model(selected_model_name)
-        response = model_instance.generate_content(full_prompt)
+        if run_stream:
+            out = queue.SimpleQueue()
+            _analysis_executor.submit(analyze_streamed, model_instance, out)
+            return Response(relay_analysis(out), mimetype='text/event-stream')
+        full_prompt = build_analysis_prompt(model_instance, document_text, prompt_from_user)
+        summary = generate_cached(model_instance, full_prompt, text_hash, prompt_from_user)
         
-        with app.app_context():
-            doc_to_update = db.session.get(Document, new_doc_id)
-            if doc_to_update:
-                doc_to_update.summary = response.text
-                doc_to_update.status = 'Analyzed'
-                db.session.commit()
-                log_event("ANALYSIS_SUCCESS", doc_to_update.filename)
-        return jsonify({"summary": response.text, "document_text": document_text})
+        # The document is written once, when the outcome is known.
+        new_doc = new_document('Analyzed', summary)
+        db.session.add(new_doc)
+        log_event("ANALYSIS_SUCCESS", filename)
+        db.session.flush()
+        new_doc_id = new_doc.id
+        db.session.commit()
+        _analysis_executor.submit(create_context_cache, new_doc_id, document_text, text_hash, model_instance.model_name)
+        return jsonify({"summary": summary, "document_text": document_text})
 
     except Exception as e:
         print(f"An error occurred during API call or processing: {e}")
+        db.session.rollback()
         if new_doc_id:
-            with app.app_context():
-                doc_to_fail = db.session.get(Document, new_doc_id)
-                if doc_to_fail:
-                    doc_to_fail.status = 'Analysis Failed'
-                    doc_to_fail.summary = f"Analysis failed: {e}"
-                    db.session.commit()
-                    log_event("ANALYSIS_FAIL", pdf_file.filename)
+            _record_analysis_result(new_doc_id, filename, 'Analysis Failed', f"Analysis failed: {e}", "ANALYSIS_FAIL")
+        else:
+            db.session.add(new_document('Analysis Failed', f"Analysis failed: {e}"))
+            log_event("ANALYSIS_FAIL", filename)
+            db.session.commit()
         return jsonify({"error": "Failed to get a response from the AI model."}), 500
 
 @app.route('/ask', methods=['POST'])
@@ -239,8 +979,36 @@ def ask_question():
     
     try:
         model_instance = get_gemini_model(selected_model_name)
-        response = model_instance.generate_content(qa_prompt)
-        return jsonify({"answer": response.text})
+        model_name = model_instance.model_name
+        cache_key = _llm_cache_key(model_name, qa_prompt)
+        answer = cache_get(cache_key)
+        if answer is not None:
+            return jsonify({"answer": answer})
+
+        # Paraphrases of an earlier question about the same document reuse its answer.
+        document_hash = _document_hash(data['document_text'])
+        embedding = try_embed_question(data['question'])
+        if embedding is not None:
+            answer = qa_cache_lookup(document_hash, model_name, embedding)
+            if answer is not None:
+                return jsonify({"answer": answer})
+
+        answer = None
+        cache_name = find_context_cache(document_hash, model_name)
+        if cache_name:
+            # The document already lives in Gemini's context cache, so only the question is sent.
+            try:
+                answer = call_gemini(_cached_content_model(cache_name), _build_cached_qa_prompt(data['question']), cache_key)
+            except Exception as e:
+                print(f"Context cache {cache_name} unusable, sending the full document: {e}")
+        if answer is None:
+            if _approx_tokens(qa_prompt) > MAX_PROMPT_TOKENS:
+                return jsonify({"error": "This document is too large to ask questions about."}), 413
+            answer = call_gemini(model_instance, qa_prompt, cache_key)
+        cache_put(cache_key, answer)
+        if embedding is not None:
+            qa_cache_put(document_hash, model_name, data['question'], embedding, answer)
+        return jsonify({"answer": answer})
     except ValueError as e:
         print(f"Gemini API initialization error for /ask: {e}")
         return jsonify({"error": f"AI model configuration error for chat: {e}"}), 500
@@ -248,25 +1016,92 @@ def ask_question():
         print(f"An error occurred during /ask API call: {e}")
         return jsonify({"error": "Failed to get a response for your question. Check server logs for details."}), 500
 
+@app.route('/document/<int:doc_id>/status', methods=['GET'])
+def get_document_status(doc_id):
+    row = db.session.execute(
+        select(Document.id, Document.status, Document.summary).where(Document.id == doc_id)
+    ).first()
+    if row is None:
+        return jsonify({"error": "Document not found."}), 404
+    result = {"id": row.id, "status": row.status}
+    if row.status in ('Analyzed', 'Analysis Failed'):
+        result["summary"] = row.summary
+    return jsonify(result)
+
+PAGE_SIZE = 100
+
+def _page_params():
+    """Reads ?limit= and the ?before= keyset cursor ("<ISO timestamp>,<id>") from the query string."""
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), PAGE_SIZE)
+    before = request.args.get('before')
+    if not before:
+        return max(limit, 1), None
+    timestamp, _, row_id = before.rpartition(',')
+    return max(limit, 1), (datetime.fromisoformat(timestamp), int(row_id))
+
+def _paged_response(items, last_row, limit: int):
+    # Timestamps can tie, so the cursor carries the id too and pages never skip rows at a boundary.
+    response = jsonify(items)
+    if len(items) == limit:
+        response.headers['X-Next-Cursor'] = f"{last_row.sort_key.isoformat()},{last_row.id}"
+    return response
+
+# Dates are formatted by Postgres (to_char) so list endpoints can build dicts straight from rows.
+_DOCUMENT_DATE_FORMAT = 'Mon DD, YYYY'
+_HISTORY_TIMESTAMP_FORMAT = 'Mon DD, YYYY, HH12:MI AM'
+
 @app.route('/documents', methods=['GET'])
 def get_documents():
-    with app.app_context(): # Ensure app context for db query
-        documents = Document.query.order_by(Document.upload_date.desc()).all()
-    return jsonify([doc.to_dict() for doc in documents])
+    try:
+        limit, before = _page_params()
+    except ValueError:
+        return jsonify({"error": "Invalid 'before' cursor."}), 400
+    query = select(
+        Document.id, Document.filename, func.to_char(Document.upload_date, _DOCUMENT_DATE_FORMAT).label('upload_date'),
+        Document.status, Document.model_used, Document.upload_date.label('sort_key')
+    ).order_by(Document.upload_date.desc(), Document.id.desc()).limit(limit)
+    if before:
+        query = query.where(tuple_(Document.upload_date, Document.id) < before)
+    rows = db.session.execute(query).all()
+    documents = [
+        {"id": row.id, "filename": row.filename, "upload_date": row.upload_date, "status": row.status, "model_used": row.model_used}
+        for row in rows
+    ]
+    return _paged_response(documents, rows[-1] if rows else None, limit)
 
 @app.route('/history', methods=['GET'])
 def get_history():
-    with app.app_context(): # Ensure app context for db query
-        events = HistoryEvent.query.order_by(HistoryEvent.timestamp.desc()).all()
-    return jsonify([event.to_dict() for event in events])
+    try:
+        limit, before = _page_params()
+    except ValueError:
+        return jsonify({"error": "Invalid 'before' cursor."}), 400
+    query = select(
+        HistoryEvent.id, HistoryEvent.event_type, HistoryEvent.document_name,
+        func.to_char(HistoryEvent.timestamp, _HISTORY_TIMESTAMP_FORMAT).label('timestamp'), HistoryEvent.timestamp.label('sort_key')
+    ).order_by(HistoryEvent.timestamp.desc(), HistoryEvent.id.desc()).limit(limit)
+    if before:
+        query = query.where(tuple_(HistoryEvent.timestamp, HistoryEvent.id) < before)
+    rows = db.session.execute(query).all()
+    events = [
+        {"id": row.id, "event_type": row.event_type, "document_name": row.document_name, "timestamp": row.timestamp}
+        for row in rows
+    ]
+    return _paged_response(events, rows[-1] if rows else None, limit)
+
+@app.route('/document/<int:doc_id>/text', methods=['GET'])
+def get_document_text(doc_id):
+    doc = db.session.get(Document, doc_id, options=[undefer(Document.full_text)])
+    if doc is None:
+        return jsonify({"error": "Document not found."}), 404
+    return jsonify(doc.to_full_dict())
 
 @app.route('/document/<int:doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
-    with app.app_context(): # Ensure app context for db operations
-        doc = Document.query.get_or_404(doc_id)
-        db.session.delete(doc)
-        db.session.commit()
-        log_event("DELETE_DOCUMENT", doc.filename)
+    row = db.session.execute(delete(Document).where(Document.id == doc_id).returning(Document.filename)).first()
+    if row is None:
+        abort(404)
+    db.session.commit()
+    log_event("DELETE_DOCUMENT", row.filename)
     return jsonify({"message": "Document deleted successfully."})
 
 # This is a root route to confirm the server is running.
@@ -277,6 +1112,5 @@ def index():
 # --- APPLICATION RUNNER ---
 # This part is for local development only and will not be used by Render's Gunicorn.
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True, port=5000, threaded=False)
+    init_db()
+    app.run(debug=True, port=5000)
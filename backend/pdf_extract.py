@@ -0,0 +1,22 @@
+"""PDF page-text extraction that runs inside the extraction worker processes.
+
+Kept apart from app.py and importing only pypdfium2, so a worker that unpickles one of these
+functions doesn't import the Flask app, its database engine and the Gemini client with it.
+"""
+import pypdfium2 as pdfium
+
+
+def page_text(page):
+    textpage = page.get_textpage()
+    text = textpage.get_text_range()
+    textpage.close()
+    page.close()
+    return text
+
+def extract_pages(pdf_bytes: bytes, start: int, stop: int):
+    # pypdfium2 handles can't be pickled, so each worker reopens the document.
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return [page_text(pdf[i]) for i in range(start, stop)]
+    finally:
+        pdf.close()